@@ -1,12 +1,29 @@
 import os
+import fnmatch
+import hashlib
+import hmac
+import json
 import subprocess
 import sys
 import logging
 import shlex
 import re
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+try:
+    import resource  # Solo disponible en Unix (RSS pico por etapa)
+except ImportError:
+    resource = None
+
 # --- CONFIGURACIÓN DE LOGS SEGURA ---
 LOG_FILE = os.path.join(os.path.expanduser("~"), ".autocommit.log")
 MAX_LOG_SIZE = 10 * 1024 * 1024  # 10MB máximo
@@ -65,18 +82,107 @@ SENSITIVE_PATTERNS_REGEX = [
     r'(?i)\.(p12|pfx|keystore|jks)$'  # Keystores
 ]
 
+# Patrones de contenido sospechoso (análisis de los primeros 10KB)
+SUSPICIOUS_CONTENT_PATTERNS = [
+    r'(?i)(password|pwd)\s*[=:]\s*[^\s]{3,}',
+    r'(?i)(api[_-]?key|token)\s*[=:]\s*[^\s]{10,}',
+    r'(?i)(secret|private[_-]?key)\s*[=:]\s*[^\s]{5,}',
+    r'-----BEGIN\s+(PRIVATE\s+KEY|CERTIFICATE)',
+    r'(?i)(mysql|postgres|mongodb)://.*:.*@'
+]
+
+# Huella de las reglas: invalida resultados cacheados si cambian los patrones
+RULE_PACK_HASH = hashlib.sha256(
+    "\n".join(SENSITIVE_PATTERNS_REGEX + SUSPICIOUS_CONTENT_PATTERNS).encode('utf-8')
+).hexdigest()
+
+# Checkpoint de escaneo incremental por repositorio (dentro del directorio .git)
+SCAN_CHECKPOINT_ENABLED = os.getenv("AUTOCOMMIT_SCAN_CHECKPOINT", "1") != "0"
+SCAN_CHECKPOINT_FILE = os.path.join("autocommit", "scan-checkpoint.json")
+BLOB_HASH_CHUNK = 1024 * 1024  # Lectura por bloques al calcular ids de blob
+
+# Almacén compartido de veredictos (clave: blob Git + RULE_PACK_HASH). Opcional:
+# desactivado salvo que se configure una ruta a SQLite (o "sqlite:///ruta") o una
+# URL http(s):// de un servidor compatible. Solo debe apuntar a un almacén de
+# confianza: un veredicto "limpio" evita leer el archivo.
+VERDICT_STORE = os.getenv("AUTOCOMMIT_VERDICT_STORE", "")
+VERDICT_STORE_TIMEOUT = 5  # segundos
+VERDICT_QUERY_BATCH = 500  # blobs por consulta/publicación
+
 # Límites de seguridad
 MAX_INPUT_LENGTH = 1000
 COMMAND_TIMEOUT = 30  # segundos
 MAX_LOG_SIZE = 10 * 1024 * 1024  # 10MB
 
+# --- CONFIGURACIÓN DE PUSH ---
+# Destinos separados por comas: "remoto" o "remoto:rama_destino".
+# Ejemplo: AUTOCOMMIT_PUSH_TARGETS="origin,gitlab,backup:mirror/main"
+# El remoto del primer destino es el principal: desde él se hace pull de la rama actual.
+PUSH_TARGETS = os.getenv("AUTOCOMMIT_PUSH_TARGETS", "origin")
+MAX_PUSH_WORKERS = 4  # Pushes concurrentes como máximo
+
+# --- LÍMITES DE RECURSOS ---
+# Cada límite degrada de forma segura en lugar de agotar la memoria:
+# - Captura: la salida de git se guarda en disco y solo se cargan MAX_CAPTURE_BYTES;
+#   lo que exceda se descarta y la salida queda marcada como truncada.
+# - Archivos/tiempo de escaneo: los archivos restantes no se analizan y se
+#   reportan como hallazgos que requieren confirmación.
+def _env_limit(name, default, cast=int):
+    """Lee un límite positivo de una variable de entorno; si es inválido usa el valor por defecto."""
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    try:
+        value = cast(raw)
+        if value > 0:
+            return value
+    except ValueError:
+        pass
+    logging.warning(f"Valor inválido en {name}={raw!r}, se usa {default}")
+    return default
+
+MAX_CAPTURE_BYTES = _env_limit("AUTOCOMMIT_MAX_CAPTURE_BYTES", 16 * 1024 * 1024)
+MAX_STDERR_BYTES = 64 * 1024
+MAX_SCAN_FILES = _env_limit("AUTOCOMMIT_MAX_SCAN_FILES", 5000)
+MAX_SCAN_SECONDS = _env_limit("AUTOCOMMIT_MAX_SCAN_SECONDS", 60.0, float)
+
+# Perfilado por etapa (tracemalloc tiene costo, solo se activa a pedido)
+PROFILE_ENABLED = os.getenv("AUTOCOMMIT_PROFILE", "0") == "1"
+STAGE_STATS = []
+_OPEN_STAGE_PEAKS = []  # Picos tracemalloc de las etapas abiertas (permite anidar etapas)
+
+# --- POLÍTICA DE CONFIRMACIÓN NO INTERACTIVA ---
+# AUTOCOMMIT_POLICY: archivo JSON con reglas declarativas por hallazgo (ver README).
+# AUTOCOMMIT_POLICY_KEY: clave HMAC con la que se firma el allowlist de la política.
+# AUTOCOMMIT_NONINTERACTIVE=1: nunca llamar a input(); sin política se deniega todo.
+POLICY_FILE = os.getenv("AUTOCOMMIT_POLICY", "")
+POLICY_KEY = os.getenv("AUTOCOMMIT_POLICY_KEY", "")
+NONINTERACTIVE = os.getenv("AUTOCOMMIT_NONINTERACTIVE", "0") == "1"
+# Acciones de la más estricta a la más permisiva (si una ruta tiene varios hallazgos, gana la primera)
+POLICY_ACTIONS = ("deny", "quarantine", "unstage", "prompt", "allow")
+CONFIRM_ACTIONS = ("deny", "prompt", "allow")
+
+# Status sin detección de renombres: evita leer blobs (y descargas en clones parciales)
+STATUS_COMMAND = ['git', 'status', '--porcelain', '--no-renames']
+
 # Caracteres peligrosos para shell injection
 DANGEROUS_CHARS = {';', '&', '|', '$', '`', '(', ')', '<', '>', '\n', '\r'}
 
+# Prefijo conventional commit con scope ("feat(api):", "fix(core)!:"); el scope solo admite [\w.-/]
+COMMIT_SCOPE_REGEX = re.compile(r'^[a-z]+\([\w\-./]+\)!?:')
+
+# --- MENSAJE DE COMMIT GENERADO ---
+DEFAULT_COMMIT_MESSAGE = "Update via AutoCommit CLI"
+MAX_MESSAGE_MODULES = 3  # Módulos nombrados en el mensaje; el resto se resume como "y N más"
+
 class SecurityError(Exception):
     """Excepción para errores de seguridad"""
     pass
 
+class CapturedOutput(str):
+    """Salida de un comando; truncated indica que se alcanzó MAX_CAPTURE_BYTES."""
+    truncated = False
+
 def log_and_print(msg, level="info"):
     """Imprime en pantalla y guarda en el log de forma segura."""
     # Sanitizar mensaje para logs (remover información sensible)
@@ -104,8 +210,13 @@ def validate_git_input(user_input, input_type='message'):
     if len(user_input) > MAX_INPUT_LENGTH:
         raise SecurityError(f"{input_type} excede límite de {MAX_INPUT_LENGTH} caracteres")
     
-    # Verificar caracteres peligrosos
-    dangerous_found = [char for char in DANGEROUS_CHARS if char in user_input]
+    # Verificar caracteres peligrosos (en mensajes, fuera del scope "tipo(scope):")
+    checked = user_input
+    if input_type == 'message':
+        scope = COMMIT_SCOPE_REGEX.match(user_input.lstrip())
+        if scope:
+            checked = user_input.lstrip()[scope.end():]
+    dangerous_found = [char for char in DANGEROUS_CHARS if char in checked]
     if dangerous_found:
         raise SecurityError(f"Caracteres peligrosos detectados en {input_type}: {dangerous_found}")
     
@@ -122,8 +233,11 @@ def validate_git_input(user_input, input_type='message'):
     
     return user_input.strip()
 
-def run_command_secure(cmd_parts, cwd=None, exit_on_error=True):
-    """Ejecuta comandos Git de forma segura sin shell injection."""
+def run_command_secure(cmd_parts, cwd=None, exit_on_error=True, no_lazy_fetch=False):
+    """
+    Ejecuta comandos Git de forma segura sin shell injection.
+    Con no_lazy_fetch=True se prohíben descargas perezosas de blobs (clones parciales).
+    """
     if isinstance(cmd_parts, str):
         raise SecurityError("Use lista de argumentos, no string para prevenir shell injection")
     
@@ -136,17 +250,36 @@ def run_command_secure(cmd_parts, cwd=None, exit_on_error=True):
         safe_cmd = ['git'] + ['***' if 'password' in str(arg).lower() else str(arg) for arg in cmd_parts[1:]]
         logging.debug(f"Ejecutando comando seguro: {safe_cmd} en {cwd}")
         
-        result = subprocess.run(
-            cmd_parts,
-            cwd=cwd,
-            shell=False,  # CRÍTICO: Nunca usar shell=True
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            timeout=COMMAND_TIMEOUT  # Prevenir comandos colgados
-        )
-        return result.stdout.strip()
+        env = None
+        if no_lazy_fetch:
+            # Clones con --filter=blob:none: nunca descargar blobs durante status/escaneo/add
+            env = dict(os.environ, GIT_NO_LAZY_FETCH='1')
+        
+        # Salida a archivos temporales: la memoria no crece con la salida de git
+        with tempfile.TemporaryFile() as out_file, tempfile.TemporaryFile() as err_file:
+            try:
+                subprocess.run(
+                    cmd_parts,
+                    cwd=cwd,
+                    env=env,
+                    shell=False,  # CRÍTICO: Nunca usar shell=True
+                    check=True,
+                    stdout=out_file,
+                    stderr=err_file,
+                    timeout=COMMAND_TIMEOUT  # Prevenir comandos colgados
+                )
+            except subprocess.CalledProcessError as e:
+                e.stderr, _ = _read_bounded(err_file, MAX_STDERR_BYTES)
+                raise
+            
+            text, truncated = _read_bounded(out_file, MAX_CAPTURE_BYTES)
+        
+        # Solo el salto final: el espacio inicial es parte del formato porcelain (" M archivo")
+        output = CapturedOutput(text.rstrip('\r\n'))
+        if truncated:
+            output.truncated = True
+            logging.warning(f"Salida de {safe_cmd[:3]} truncada a {MAX_CAPTURE_BYTES} bytes")
+        return output
         
     except subprocess.TimeoutExpired:
         error_msg = f"Comando excedió timeout de {COMMAND_TIMEOUT}s"
@@ -182,90 +315,454 @@ def run_command_secure(cmd_parts, cwd=None, exit_on_error=True):
             sys.exit(1)
         return None
 
-def enhanced_security_scan(repo_path):
+def _read_bounded(stream, limit):
+    """
+    Lee como máximo limit bytes de un archivo temporal. Si hay más, corta en el
+    último separador (salto de línea o NUL) para no entregar registros parciales.
+    Retorna (texto, truncado).
+    """
+    stream.seek(0)
+    data = stream.read(limit + 1)
+    truncated = len(data) > limit
+    if truncated:
+        data = data[:limit]
+        cut = max(data.rfind(b'\n'), data.rfind(b'\0'))
+        data = data[:cut + 1]  # Sin separador (cut = -1): ningún registro completo
+    return data.decode('utf-8', errors='replace'), truncated
+
+def _peak_rss_mb(who):
+    """
+    RSS máximo en MB desde el inicio del proceso (o del mayor hijo, ej: git), None
+    si no está disponible. Es acumulado: no baja al terminar una etapa.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reporta KB; macOS reporta bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+@contextmanager
+def stage_monitor(stage):
+    """
+    Mide tiempo, RSS máximo acumulado (propio y de git) y cuánto creció durante
+    la etapa y, con AUTOCOMMIT_PROFILE=1, el pico de memoria Python (tracemalloc)
+    de la etapa. Registra el resultado en el log y en STAGE_STATS. Las etapas
+    se pueden anidar: el pico de la etapa exterior se conserva.
+    """
+    rss_start = _peak_rss_mb(resource.RUSAGE_SELF) if resource else None
+    git_rss_start = _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None
+    started_tracing = PROFILE_ENABLED and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    elif tracemalloc.is_tracing():
+        # reset_peak() es global: antes se guarda el pico de las etapas exteriores
+        peak = tracemalloc.get_traced_memory()[1]
+        for outer in _OPEN_STAGE_PEAKS:
+            outer["peak"] = max(outer["peak"], peak)
+        tracemalloc.reset_peak()
+    stage_peak = {"peak": 0}
+    _OPEN_STAGE_PEAKS.append(stage_peak)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _OPEN_STAGE_PEAKS.remove(stage_peak)
+        stats = {
+            "stage": stage,
+            "seconds": time.perf_counter() - start,
+            "rss_mb": _peak_rss_mb(resource.RUSAGE_SELF) if resource else None,
+            "git_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+            "rss_growth_mb": None,
+            "git_rss_growth_mb": None,
+            "py_peak_mb": None
+        }
+        if resource:
+            stats["rss_growth_mb"] = stats["rss_mb"] - rss_start
+            stats["git_rss_growth_mb"] = stats["git_rss_mb"] - git_rss_start
+        if tracemalloc.is_tracing():
+            peak = max(stage_peak["peak"], tracemalloc.get_traced_memory()[1])
+            stats["py_peak_mb"] = peak / (1024 * 1024)
+        if started_tracing:
+            tracemalloc.stop()
+        STAGE_STATS.append(stats)
+        logging.info(f"Recursos etapa {stage}: {_format_stage_stats(stats)}")
+
+def _format_stage_stats(stats):
+    """Formatea las métricas de una etapa en una línea legible."""
+    parts = [f"{stats['seconds']:.2f}s"]
+    if stats["rss_mb"] is not None:
+        parts.append(f"RSS máx. acumulado {stats['rss_mb']:.1f}MB (+{stats['rss_growth_mb']:.1f}MB en la etapa)")
+        parts.append(f"git máx. acumulado {stats['git_rss_mb']:.1f}MB (+{stats['git_rss_growth_mb']:.1f}MB)")
+    if stats["py_peak_mb"] is not None:
+        parts.append(f"tracemalloc pico {stats['py_peak_mb']:.2f}MB")
+    return ", ".join(parts)
+
+def enhanced_security_scan(repo_path, excluded_paths=None, policy=None):
     """
     Escanea archivos modificados con patrones regex mejorados y análisis de contenido.
-    Retorna True si es seguro proceder, False si el usuario cancela.
+    Retorna True si es seguro proceder, False si el usuario (o la política) cancela.
+    Con política activa los hallazgos se deciden sin preguntar; las rutas que la
+    política saca del commit (unstage/quarantine) se agregan a excluded_paths.
     """
     try:
-        status_output = run_command_secure(['git', 'status', '--porcelain'], cwd=repo_path, exit_on_error=False)
-        if not status_output: 
+        status_output = run_command_secure(STATUS_COMMAND, cwd=repo_path, exit_on_error=False, no_lazy_fetch=True)
+        if not status_output and not getattr(status_output, 'truncated', False): 
             return True
 
-        suspicious_files = []
-        high_risk_files = []
+        entries, outside_cone, high_risk_files = _classify_status_entries(status_output, get_sparse_cone(repo_path))
+        scan = _start_incremental_scan(repo_path)
+        findings = []  # [(ruta, motivo)]
         
-        for line in status_output.splitlines():
-            # Formato porcelain: "M  archivo.txt" o "?? archivo.txt"
-            if len(line) < 4:
-                continue
-                
-            filename = line[3:].strip()
-            
-            # Validar nombre de archivo seguro
-            try:
-                validate_git_input(filename, 'filename')
-            except SecurityError:
-                high_risk_files.append(f"{filename} (caracteres peligrosos)")
-                continue
-            
-            # Verificar contra patrones regex 
-            for pattern in SENSITIVE_PATTERNS_REGEX:
-                if re.search(pattern, filename):
-                    risk_level = "ALTO" if any(word in filename.lower() for word in ['key', 'password', 'secret']) else "MEDIO"
-                    suspicious_files.append(f"{filename} (riesgo {risk_level})")
-                    break
-            
-            # Análisis adicional de contenido para archivos nuevos/modificados
-            if line.startswith(('A ', 'M ')) and os.path.exists(os.path.join(repo_path, filename)):
-                if _analyze_file_content(os.path.join(repo_path, filename)):
-                    suspicious_files.append(f"{filename} (contenido sospechoso)")
+        # Lista de cambios incompleta: no se puede afirmar que el resto sea seguro
+        if getattr(status_output, 'truncated', False):
+            scan["complete"] = False
+            scan["reusable"] = False
+            findings.append(("", f"status truncado a {MAX_CAPTURE_BYTES} bytes: hay cambios sin escanear"))
+        
+        for line, filename in entries:
+            findings.extend(_scan_status_entry(repo_path, scan, line, filename))
+        
+        confirmed = _finish_incremental_scan(repo_path, scan)
+        _report_outside_cone(outside_cone)
         
         # Mostrar alertas por nivel de riesgo
         if high_risk_files:
-            print("\n🔴 ALERTA CRÍTICA DE SEGURIDAD 🔴")
-            print("Archivos con caracteres PELIGROSOS detectados:")
-            for f in high_risk_files:
-                print(f"   - {f}")
-            logging.error(f"Archivos con caracteres peligrosos: {high_risk_files}")
-            log_and_print("Operación BLOQUEADA por seguridad crítica.", "error")
+            _report_high_risk_files(high_risk_files)
             return False
         
-        if suspicious_files:
-            print("\n🟡 ALERTA DE SEGURIDAD 🟡")
-            print("Archivos que parecen contener CLAVES, SECRETOS o CONFIGURACIONES:")
-            for f in suspicious_files:
-                print(f"   - {f}")
-            
-            logging.warning(f"Archivos sensibles detectados: {suspicious_files}")
-            
-            # Confirmación más estricta
-            print("\n⚠️  ATENCIÓN: Subir estos archivos puede exponer información sensible.")
-            print("¿Estás ABSOLUTAMENTE SEGURO de que es seguro subirlos?")
-            
-            for attempt in range(3):  # Máximo 3 intentos
-                confirm = input(f"Escribe 'CONFIRMO' (exacto, intento {attempt+1}/3): ")
-                if confirm == "CONFIRMO":
-                    logging.info(f"Usuario confirmó subida de archivos sensibles tras {attempt+1} intentos")
-                    return True
-                elif confirm == "":
-                    log_and_print("Operación cancelada por el usuario.", "warning")
-                    return False
-                else:
-                    print(f"❌ Respuesta incorrecta: '{confirm}'. Debe escribir exactamente 'CONFIRMO'")
-            
-            log_and_print("Operación cancelada tras 3 intentos fallidos.", "warning")
-            return False
+        if findings and scan["reusable"] and scan["finding_keys"] <= confirmed:
+            logging.info(f"Hallazgos ya confirmados con contenido idéntico: {findings}")
+            print(f"   ℹ️  {len(findings)} hallazgo(s) confirmados previamente con el mismo contenido")
+            findings = []
         
-        return True
+        return _resolve_findings(repo_path, scan, findings, policy, excluded_paths)
         
     except Exception as e:
         logging.error(f"Error durante escaneo de seguridad: {e}")
         log_and_print(f"Error en escaneo de seguridad: {e}", "error")
         return False
 
+def _classify_status_entries(status_output, sparse_cone):
+    """
+    Separa las líneas de status en entradas a escanear [(línea, ruta)], rutas
+    fuera del cono sparse y rutas con caracteres peligrosos.
+    """
+    entries = []
+    outside_cone = []
+    high_risk_files = []
+    for line in status_output.splitlines():
+        # Formato porcelain: "M  archivo.txt" o "?? archivo.txt"
+        if len(line) < 4:
+            continue
+            
+        filename = line[3:].strip()
+        
+        # En sparse checkout solo se escanea lo que está dentro del cono
+        if sparse_cone is not None and not is_path_in_sparse_cone(filename, sparse_cone):
+            outside_cone.append(filename)
+            continue
+        
+        # Validar nombre de archivo seguro
+        try:
+            validate_git_input(filename, 'filename')
+        except SecurityError:
+            high_risk_files.append(f"{filename} (caracteres peligrosos)")
+            continue
+        
+        entries.append((line, filename))
+    return entries, outside_cone, high_risk_files
+
+def _start_incremental_scan(repo_path):
+    """
+    Prepara el estado del escaneo incremental: checkpoint, blobs staged que
+    difieren del último árbol limpio y veredictos conocidos (checkpoint + almacén).
+    """
+    checkpoint = load_scan_checkpoint(repo_path)
+    staged_blobs = get_staged_blobs(repo_path, checkpoint["clean_tree"])
+    verdicts = dict(checkpoint["verdicts"])
+    
+    # Consulta en lote al almacén compartido: los blobs con veredicto no se leen
+    verdict_store = get_verdict_store()
+    if staged_blobs:
+        unknown = set(staged_blobs.values()) - set(verdicts)
+        verdicts.update(lookup_verdicts(verdict_store, unknown))
+    
+    return {
+        "checkpoint": checkpoint,
+        "staged_blobs": staged_blobs,
+        "verdicts": verdicts,
+        "verdict_store": verdict_store,
+        "seen_verdicts": {},
+        "new_verdicts": {},
+        "finding_keys": set(),
+        "finding_blobs": {},      # ruta -> blob (None si no tiene contenido identificable)
+        "staged_findings": set(), # rutas con hallazgos que están en el índice
+        "reusable": True,   # Todos los hallazgos tienen clave ruta:blob
+        "complete": True,   # Todo lo pendiente fue analizado
+        "deadline": time.monotonic() + MAX_SCAN_SECONDS,
+        "files_read": 0,
+        "skipped_by_limit": 0
+    }
+
+def _scan_status_entry(repo_path, scan, line, filename):
+    """Escanea una entrada de status; retorna sus hallazgos y registra su clave de confirmación."""
+    filepath = os.path.join(repo_path, filename)
+    fully_staged = line.startswith(('A ', 'M '))
+    staged_blobs = scan["staged_blobs"]
+    
+    # Contenido staged idéntico al último escaneo limpio: ya fue revisado
+    if fully_staged and staged_blobs is not None and filename not in staged_blobs:
+        return []
+    
+    blob_id = staged_blobs.get(filename) if fully_staged and staged_blobs else None
+    findings = []
+    
+    # Verificar contra patrones regex 
+    for pattern in SENSITIVE_PATTERNS_REGEX:
+        if re.search(pattern, filename):
+            risk_level = "ALTO" if any(word in filename.lower() for word in ['key', 'password', 'secret']) else "MEDIO"
+            findings.append((filename, f"riesgo {risk_level}"))
+            break
+    
+    # Análisis adicional de contenido para archivos nuevos/modificados
+    if fully_staged and os.path.exists(filepath):
+        content_finding = _scan_staged_content(scan, filepath, blob_id)
+        if content_finding:
+            findings.append((filename, content_finding))
+    elif line[0] in 'AMT' and (staged_blobs is None or filename in staged_blobs):
+        # Contenido staged distinto del disco (AM, MM...): no se analiza, así que
+        # el índice no puede registrarse como árbol limpio
+        scan["complete"] = False
+    
+    if findings:
+        if line[0] not in ' ?':
+            scan["staged_findings"].add(filename)
+        _record_finding_key(scan, filename, filepath, blob_id)
+    return findings
+
+def _scan_staged_content(scan, filepath, blob_id):
+    """Analiza el contenido staged reutilizando veredictos por blob; retorna el motivo o None."""
+    if blob_id in scan["verdicts"]:
+        is_suspicious = scan["verdicts"][blob_id]
+    elif not _take_scan_budget(scan):
+        # Límite alcanzado: no se analiza, pero exige confirmación
+        return "no analizado: límite de escaneo"
+    else:
+        is_suspicious = _analyze_file_content(filepath)
+        if is_suspicious is None:
+            # Lectura fallida: ni checkpoint ni almacén, y el índice no queda como limpio
+            scan["complete"] = False
+            return None
+        if blob_id:
+            scan["new_verdicts"][blob_id] = is_suspicious
+    
+    if blob_id:
+        scan["seen_verdicts"][blob_id] = is_suspicious
+    return "contenido sospechoso" if is_suspicious else None
+
+def _take_scan_budget(scan):
+    """
+    Reserva una lectura de archivo dentro de MAX_SCAN_FILES / MAX_SCAN_SECONDS.
+    Retorna False (y marca el escaneo como incompleto) si ya se agotó el límite.
+    """
+    if scan["files_read"] >= MAX_SCAN_FILES or time.monotonic() > scan["deadline"]:
+        scan["skipped_by_limit"] += 1
+        scan["complete"] = False
+        return False
+    scan["files_read"] += 1
+    return True
+
+def _record_finding_key(scan, filename, filepath, blob_id):
+    """
+    Registra la clave "ruta:blob" de un hallazgo. Directorios sin seguimiento y
+    rutas sin contenido (eliminadas) no tienen blob: nunca reutilizan confirmaciones.
+    """
+    scan["finding_blobs"][filename] = None
+    if filename.endswith('/'):
+        scan["reusable"] = False
+        return
+    
+    # Solo se calcula el blob del archivo en disco para rutas con hallazgos,
+    # y dentro de los mismos límites que el análisis de contenido
+    if blob_id is None and _take_scan_budget(scan):
+        blob_id = _worktree_blob_id(filepath)
+    if blob_id is None:
+        scan["reusable"] = False
+    else:
+        scan["finding_blobs"][filename] = blob_id
+        scan["finding_keys"].add(f"{filename}:{blob_id}")
+
+def _finish_incremental_scan(repo_path, scan):
+    """
+    Publica los veredictos nuevos y guarda el checkpoint (aunque el usuario luego
+    cancele: el próximo intento no relee archivos). Retorna las confirmaciones previas.
+    """
+    if scan["skipped_by_limit"]:
+        log_and_print(f"Límite de escaneo alcanzado ({MAX_SCAN_FILES} archivos / {MAX_SCAN_SECONDS:.0f}s): "
+                      f"{scan['skipped_by_limit']} lectura(s) de archivo omitidas.", "warning")
+    
+    publish_verdicts(scan["verdict_store"], scan["new_verdicts"])
+    
+    checkpoint = scan["checkpoint"]
+    checkpoint["verdicts"] = scan["seen_verdicts"]
+    confirmed = set(checkpoint["confirmed"])
+    checkpoint["confirmed"] = sorted(confirmed & scan["finding_keys"])
+    save_scan_checkpoint(repo_path, checkpoint)
+    return confirmed
+
+def _format_finding(finding):
+    """Texto de un hallazgo (ruta, motivo) para mostrar en pantalla."""
+    path, reason = finding
+    return f"{path} ({reason})" if path else f"({reason})"
+
+def _resolve_findings(repo_path, scan, findings, policy, excluded_paths):
+    """
+    Decide los hallazgos pendientes: con política activa sin preguntar; si no,
+    con la confirmación 'CONFIRMO'. Si stdin está cerrado se aplica la política
+    por defecto (denegar) en lugar de fallar. Retorna True si se puede continuar.
+    """
+    if findings:
+        if policy is None:
+            policy = get_active_policy()
+        if policy is not None:
+            return _apply_policy(repo_path, scan, findings, policy, excluded_paths)
+        try:
+            approved = _confirm_sensitive_files([_format_finding(f) for f in findings])
+        except EOFError:
+            log_and_print("Entrada no disponible (stdin cerrado): se aplica la política por defecto.", "warning")
+            return _apply_policy(repo_path, scan, findings, load_policy(path=""), excluded_paths)
+        if not approved:
+            return False
+        scan["checkpoint"]["confirmed"] = sorted(scan["finding_keys"])
+    
+    mark_scan_clean(repo_path, scan["checkpoint"], complete=scan["complete"])
+    return True
+
+def _apply_policy(repo_path, scan, findings, policy, excluded_paths):
+    """Aplica la política a cada hallazgo, audita cada decisión y ejecuta unstage/quarantine."""
+    decisions = _decide_findings(repo_path, scan, findings, policy)
+    
+    if "deny" in decisions.values():
+        denied = [path or "(status)" for path, action in decisions.items() if action == "deny"]
+        log_and_print(f"Operación BLOQUEADA por la política de confirmación: {denied}", "error")
+        return False
+    
+    allowed_keys = set(scan["checkpoint"]["confirmed"])
+    for path, action in decisions.items():
+        if action in ("unstage", "quarantine"):
+            _exclude_path(repo_path, path, quarantine=(action == "quarantine"),
+                          staged=path in scan["staged_findings"])
+            if excluded_paths is not None:
+                excluded_paths.add(path)
+            print(f"   🚧 {path}: excluido del commit ({action})")
+        elif scan["finding_blobs"].get(path):
+            allowed_keys.add(f"{path}:{scan['finding_blobs'][path]}")
+    
+    scan["checkpoint"]["confirmed"] = sorted(allowed_keys)
+    mark_scan_clean(repo_path, scan["checkpoint"], complete=scan["complete"])
+    return True
+
+def _decide_findings(repo_path, scan, findings, policy):
+    """Retorna {ruta: acción}, quedándose con la acción más estricta de cada ruta."""
+    decisions = {}
+    to_prompt = []
+    for path, reason in findings:
+        action, source = decide_finding(policy, path, reason, scan["finding_blobs"].get(path))
+        if action == "prompt" and NONINTERACTIVE:
+            action, source = "deny", f"{source} (sin terminal)"
+        if action in ("unstage", "quarantine") and not path:
+            action, source = "deny", f"{source} (sin ruta)"  # El status truncado no se puede excluir
+        if action == "prompt":
+            to_prompt.append((path, reason))
+            continue
+        audit_decision(repo_path, path, reason, action, source)
+        decisions[path] = min(action, decisions.get(path, "allow"), key=POLICY_ACTIONS.index)
+    
+    if to_prompt:
+        try:
+            approved = _confirm_sensitive_files([_format_finding(f) for f in to_prompt])
+        except EOFError:
+            approved = False
+        for path, reason in to_prompt:
+            action = "allow" if approved else "deny"
+            audit_decision(repo_path, path, reason, action, "prompt")
+            decisions[path] = min(action, decisions.get(path, "allow"), key=POLICY_ACTIONS.index)
+    return decisions
+
+def _exclude_path(repo_path, path, quarantine=False, staged=False):
+    """
+    Saca una ruta del commit: la quita del índice si estaba staged y, en
+    cuarentena, la agrega a .git/info/exclude para que no vuelva a agregarse
+    (solo tiene efecto sobre archivos sin seguimiento).
+    """
+    if staged:
+        restored = run_command_secure(['git', '--literal-pathspecs', 'restore', '--staged', '--', path],
+                                      cwd=repo_path, exit_on_error=False)
+        if restored is None:
+            # Rama sin commits: no hay HEAD del que restaurar
+            run_command_secure(['git', '--literal-pathspecs', 'rm', '--cached', '-r', '-q', '--', path],
+                               cwd=repo_path, exit_on_error=False)
+    
+    if quarantine:
+        git_dir = _git_dir(repo_path)
+        if not git_dir:
+            return
+        exclude_file = os.path.join(git_dir, "info", "exclude")
+        os.makedirs(os.path.dirname(exclude_file), exist_ok=True)
+        with open(exclude_file, 'a', encoding='utf-8') as f:
+            f.write(f"/{path}\n")
+        logging.info(f"Ruta en cuarentena (info/exclude): {path}")
+
+def _report_outside_cone(outside_cone):
+    """Informa las rutas fuera del cono sparse-checkout (no bloquean la operación)."""
+    if not outside_cone:
+        return
+    print("\nℹ️  Rutas fuera del cono sparse-checkout (no se escanean ni se suben):")
+    for f in outside_cone:
+        print(f"   - {f}")
+    logging.info(f"Rutas fuera del cono sparse: {outside_cone}")
+
+def _report_high_risk_files(high_risk_files):
+    """Informa los archivos con caracteres peligrosos, que bloquean la operación."""
+    print("\n🔴 ALERTA CRÍTICA DE SEGURIDAD 🔴")
+    print("Archivos con caracteres PELIGROSOS detectados:")
+    for f in high_risk_files:
+        print(f"   - {f}")
+    logging.error(f"Archivos con caracteres peligrosos: {high_risk_files}")
+    log_and_print("Operación BLOQUEADA por seguridad crítica.", "error")
+
+def _confirm_sensitive_files(suspicious_files):
+    """Muestra los hallazgos y pide la confirmación estricta 'CONFIRMO'."""
+    print("\n🟡 ALERTA DE SEGURIDAD 🟡")
+    print("Archivos que parecen contener CLAVES, SECRETOS o CONFIGURACIONES:")
+    for f in suspicious_files:
+        print(f"   - {f}")
+    
+    logging.warning(f"Archivos sensibles detectados: {suspicious_files}")
+    
+    # Confirmación más estricta
+    print("\n⚠️  ATENCIÓN: Subir estos archivos puede exponer información sensible.")
+    print("¿Estás ABSOLUTAMENTE SEGURO de que es seguro subirlos?")
+    
+    for attempt in range(3):  # Máximo 3 intentos
+        confirm = input(f"Escribe 'CONFIRMO' (exacto, intento {attempt+1}/3): ")
+        if confirm == "CONFIRMO":
+            logging.info(f"Usuario confirmó subida de archivos sensibles tras {attempt+1} intentos")
+            return True
+        elif confirm == "":
+            log_and_print("Operación cancelada por el usuario.", "warning")
+            return False
+        else:
+            print(f"❌ Respuesta incorrecta: '{confirm}'. Debe escribir exactamente 'CONFIRMO'")
+    
+    log_and_print("Operación cancelada tras 3 intentos fallidos.", "warning")
+    return False
+
 def _analyze_file_content(filepath):
-    """Analiza contenido de archivo en busca de patrones sospechosos."""
+    """
+    Analiza contenido de archivo en busca de patrones sospechosos. Retorna
+    True/False, o None si no se pudo leer (no es un veredicto reutilizable).
+    """
     try:
         # Solo analizar archivos de texto pequeños
         if os.path.getsize(filepath) > 1024 * 1024:  # 1MB límite
@@ -274,24 +771,518 @@ def _analyze_file_content(filepath):
         with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
             content = f.read(10000)  # Primeros 10KB
             
-            # Patrones de contenido sospechoso
-            suspicious_patterns = [
-                r'(?i)(password|pwd)\s*[=:]\s*[^\s]{3,}',
-                r'(?i)(api[_-]?key|token)\s*[=:]\s*[^\s]{10,}',
-                r'(?i)(secret|private[_-]?key)\s*[=:]\s*[^\s]{5,}',
-                r'-----BEGIN\s+(PRIVATE\s+KEY|CERTIFICATE)',
-                r'(?i)(mysql|postgres|mongodb)://.*:.*@'
-            ]
-            
-            for pattern in suspicious_patterns:
+            for pattern in SUSPICIOUS_CONTENT_PATTERNS:
                 if re.search(pattern, content):
                     return True
                     
-    except Exception:
-        pass  # Si no se puede leer, asumir seguro
+    except Exception as e:
+        logging.warning(f"No se pudo analizar {filepath}: {e}")
+        return None  # Se asume seguro, pero sin registrar veredicto
     
     return False
 
+def _worktree_blob_id(filepath):
+    """
+    Calcula el id de blob Git (SHA-1) del archivo en disco leyendo por bloques,
+    o None si no existe, es un directorio o cambió durante la lectura.
+    """
+    try:
+        size = os.path.getsize(filepath)
+        digest = hashlib.sha1(b"blob %d\0" % size)  # nosec B324 - id de objeto Git, no criptográfico
+        read = 0
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(BLOB_HASH_CHUNK), b''):
+                digest.update(chunk)
+                read += len(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest() if read == size else None
+
+@lru_cache(maxsize=None)
+def _git_dir(repo_path):
+    """Ruta absoluta del directorio Git del repositorio, o None si no se puede obtener."""
+    return run_command_secure(['git', 'rev-parse', '--absolute-git-dir'], cwd=repo_path, exit_on_error=False) or None
+
+def _scan_checkpoint_path(repo_path):
+    """Ruta del checkpoint de escaneo dentro del directorio Git del repositorio."""
+    git_dir = _git_dir(repo_path)
+    if not git_dir:
+        return None
+    return os.path.join(git_dir, SCAN_CHECKPOINT_FILE)
+
+def load_scan_checkpoint(repo_path):
+    """
+    Carga el checkpoint de escaneo: último árbol limpio, veredictos de contenido
+    por blob y hallazgos confirmados ("ruta:blob"). Retorna uno vacío si no existe,
+    está corrupto, fue generado con otras reglas o el checkpoint está desactivado.
+    """
+    empty = {"rules": RULE_PACK_HASH, "clean_tree": None, "verdicts": {}, "confirmed": []}
+    if not SCAN_CHECKPOINT_ENABLED:
+        return empty
+    
+    path = _scan_checkpoint_path(repo_path)
+    if not path or not os.path.exists(path):
+        return empty
+    
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Checkpoint de escaneo ilegible, se ignora: {e}")
+        return empty
+    
+    if not isinstance(checkpoint, dict) or checkpoint.get("rules") != RULE_PACK_HASH:
+        return empty
+    for key, default in empty.items():
+        checkpoint.setdefault(key, default)
+    return checkpoint
+
+def save_scan_checkpoint(repo_path, checkpoint):
+    """Guarda el checkpoint de forma atómica (escritura a temporal + reemplazo)."""
+    if not SCAN_CHECKPOINT_ENABLED:
+        return
+    
+    path = _scan_checkpoint_path(repo_path)
+    if not path:
+        return
+    
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"No se pudo guardar el checkpoint de escaneo: {e}")
+
+def mark_scan_clean(repo_path, checkpoint, complete=True):
+    """
+    Registra el árbol del índice actual como último estado limpio (o confirmado).
+    Si el escaneo quedó incompleto (status truncado o límites alcanzados) solo se
+    guardan las confirmaciones: el índice contiene contenido que nadie revisó.
+    """
+    if not SCAN_CHECKPOINT_ENABLED:
+        return
+    if not complete:
+        save_scan_checkpoint(repo_path, checkpoint)
+        return
+    
+    # --missing-ok: no verificar (ni descargar) blobs ausentes en clones parciales
+    tree = run_command_secure(['git', 'write-tree', '--missing-ok'], cwd=repo_path,
+                              exit_on_error=False, no_lazy_fetch=True)
+    checkpoint["clean_tree"] = tree or None
+    save_scan_checkpoint(repo_path, checkpoint)
+
+class SQLiteVerdictStore:
+    """Almacén local de veredictos en un archivo SQLite."""
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=VERDICT_STORE_TIMEOUT)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            "blob TEXT NOT NULL, rules TEXT NOT NULL, suspicious INTEGER NOT NULL, "
+            "PRIMARY KEY (blob, rules))"
+        )
+        return conn
+    
+    def get_many(self, blob_ids):
+        """Retorna {blob_id: sospechoso} de los blobs con veredicto conocido."""
+        blob_ids = list(blob_ids)
+        found = {}
+        conn = self._connect()
+        try:
+            for i in range(0, len(blob_ids), VERDICT_QUERY_BATCH):
+                batch = blob_ids[i:i + VERDICT_QUERY_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT blob, suspicious FROM verdicts WHERE rules = ? AND blob IN ({placeholders})",  # nosec B608 - solo placeholders
+                    [RULE_PACK_HASH] + batch
+                )
+                found.update((blob, bool(suspicious)) for blob, suspicious in rows)
+        finally:
+            conn.close()
+        return found
+    
+    def put_many(self, verdicts):
+        """Guarda {blob_id: sospechoso} para el RULE_PACK_HASH actual."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO verdicts (blob, rules, suspicious) VALUES (?, ?, ?)",
+                    [(blob, RULE_PACK_HASH, int(suspicious)) for blob, suspicious in verdicts.items()]
+                )
+        finally:
+            conn.close()
+
+class HTTPVerdictStore:
+    """
+    Almacén remoto compatible con HTTP (JSON):
+    POST {url}/verdicts/query  {"rules": ..., "blobs": [...]}  -> {"verdicts": {blob: bool}}
+    POST {url}/verdicts        {"rules": ..., "verdicts": {blob: bool}}
+    """
+    
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+    
+    def _post(self, path, payload):
+        request = urllib.request.Request(
+            f"{self.url}{path}",
+            data=json.dumps(payload).encode('utf-8'),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        # Esquema validado en get_verdict_store (solo http/https)
+        with urllib.request.urlopen(request, timeout=VERDICT_STORE_TIMEOUT) as response:  # nosec B310
+            body = response.read()
+        return json.loads(body) if body else {}
+    
+    def get_many(self, blob_ids):
+        """Retorna {blob_id: sospechoso} de los blobs con veredicto conocido."""
+        blob_ids = list(blob_ids)
+        found = {}
+        for i in range(0, len(blob_ids), VERDICT_QUERY_BATCH):
+            batch = blob_ids[i:i + VERDICT_QUERY_BATCH]
+            response = self._post("/verdicts/query", {"rules": RULE_PACK_HASH, "blobs": batch})
+            found.update((blob, bool(v)) for blob, v in response.get("verdicts", {}).items() if blob in batch)
+        return found
+    
+    def put_many(self, verdicts):
+        """Guarda {blob_id: sospechoso} para el RULE_PACK_HASH actual."""
+        items = list(verdicts.items())
+        for i in range(0, len(items), VERDICT_QUERY_BATCH):
+            batch = dict(items[i:i + VERDICT_QUERY_BATCH])
+            self._post("/verdicts", {"rules": RULE_PACK_HASH, "verdicts": batch})
+
+def get_verdict_store(spec=None):
+    """Crea el almacén configurado en AUTOCOMMIT_VERDICT_STORE, o None si está desactivado."""
+    spec = VERDICT_STORE if spec is None else spec
+    if not spec or spec.lower() == "off":
+        return None
+    if spec.startswith(("http://", "https://")):
+        return HTTPVerdictStore(spec)
+    if spec.startswith("sqlite:///"):
+        spec = spec[len("sqlite:///"):]
+    if "://" in spec:
+        logging.warning(f"Almacén de veredictos no soportado, se ignora: {spec}")
+        return None
+    return SQLiteVerdictStore(spec)
+
+def lookup_verdicts(store, blob_ids):
+    """Consulta en lote el almacén; cualquier fallo equivale a 'sin veredictos'."""
+    if store is None or not blob_ids:
+        return {}
+    try:
+        return store.get_many(blob_ids)
+    except Exception as e:
+        logging.warning(f"Almacén de veredictos no disponible (consulta): {e}")
+        return {}
+
+def publish_verdicts(store, verdicts):
+    """Publica veredictos nuevos; un fallo del almacén no interrumpe el escaneo."""
+    if store is None or not verdicts:
+        return
+    try:
+        store.put_many(verdicts)
+    except Exception as e:
+        logging.warning(f"Almacén de veredictos no disponible (publicación): {e}")
+
+def get_staged_blobs(repo_path, base_tree=None):
+    """
+    Retorna {ruta: blob_id} de las rutas cuyo contenido staged difiere de base_tree
+    (o de HEAD si no hay checkpoint), en una sola invocación de git y sin leer
+    archivos. Retorna None si no se puede calcular (escaneo completo).
+    """
+    cmd = ['git', 'diff', '--cached', '--raw', '-z', '--no-renames', '--no-abbrev']
+    if base_tree:
+        cmd.append(base_tree)
+    output = run_command_secure(cmd, cwd=repo_path, exit_on_error=False, no_lazy_fetch=True)
+    if output is None or getattr(output, 'truncated', False):
+        return None
+    
+    # Formato -z: ":modo_a modo_b blob_a blob_b estado\0ruta\0"
+    blobs = {}
+    fields = output.split('\0')
+    for meta, path in zip(fields[0::2], fields[1::2]):
+        parts = meta.split()
+        if len(parts) >= 5 and path:
+            blobs[path] = parts[3]
+    return blobs
+
+def summarize_staged_diff(repo_path):
+    """
+    Resume los cambios staged con un solo `git diff --cached --numstat -z -M`:
+    archivos, líneas agregadas/eliminadas, renombres y archivos por módulo
+    (primer directorio, o el nombre sin extensión para archivos en la raíz).
+    Retorna None si no se puede calcular.
+    """
+    output = run_command_secure(['git', 'diff', '--cached', '--numstat', '-z', '-M'],
+                                cwd=repo_path, exit_on_error=False, no_lazy_fetch=True)
+    if output is None or getattr(output, 'truncated', False):
+        return None
+    
+    summary = {"files": 0, "added": 0, "deleted": 0, "renamed": 0, "modules": {}, "paths": []}
+    # Formato -z: "agregadas\teliminadas\truta\0"; en renombres la ruta va vacía
+    # y le siguen "origen\0destino\0". Los binarios reportan "-\t-".
+    fields = iter(output.split('\0'))
+    for record in fields:
+        parts = record.split('\t')
+        if len(parts) != 3:
+            continue
+        added, deleted, path = parts
+        if not path:
+            next(fields, None)
+            path = next(fields, "")
+            summary["renamed"] += 1
+        summary["files"] += 1
+        summary["added"] += int(added) if added.isdigit() else 0
+        summary["deleted"] += int(deleted) if deleted.isdigit() else 0
+        module = path.split('/', 1)[0] if '/' in path else os.path.splitext(path)[0]
+        summary["modules"][module] = summary["modules"].get(module, 0) + 1
+        summary["paths"].append(path)
+    return summary
+
+def _commit_type(summary):
+    """Tipo conventional commit según las rutas tocadas."""
+    paths = summary["paths"]
+    if all(p.startswith('tests/') or '/tests/' in p or os.path.basename(p).startswith('test_') for p in paths):
+        return "test"
+    if all(p.startswith('docs/') or p.lower().endswith(('.md', '.rst')) for p in paths):
+        return "docs"
+    if summary["renamed"] == summary["files"] and not summary["added"] and not summary["deleted"]:
+        return "refactor"
+    return "chore"
+
+def generate_commit_message(repo_path):
+    """
+    Genera un mensaje conventional commit a partir del diff staged, por ejemplo
+    "chore: actualiza src, tests [12 archivos, +120 -30, 1 renombrado]".
+    Retorna el mensaje por defecto si no hay resumen o si no pasa la validación.
+    """
+    summary = summarize_staged_diff(repo_path)
+    if not summary or not summary["files"]:
+        return DEFAULT_COMMIT_MESSAGE
+    
+    # Solo se nombran módulos con caracteres seguros; los más tocados primero
+    modules = sorted(summary["modules"], key=lambda m: (-summary["modules"][m], m))
+    named = [m for m in modules if re.match(r'^[\w\-.]+$', m)][:MAX_MESSAGE_MODULES]
+    extra = len(modules) - len(named)
+    
+    files = f"{summary['files']} archivo{'s' if summary['files'] != 1 else ''}"
+    stats = [f"+{summary['added']} -{summary['deleted']}"]
+    if summary["renamed"]:
+        stats.append(f"{summary['renamed']} renombrado{'s' if summary['renamed'] != 1 else ''}")
+    
+    if len(modules) == 1 and named:
+        msg = f"{_commit_type(summary)}({named[0]}): actualiza {files} [{', '.join(stats)}]"
+    else:
+        described = ", ".join(named) + (f" y {extra} más" if extra else "")
+        msg = f"{_commit_type(summary)}: actualiza {described or 'varios módulos'} [{', '.join([files] + stats)}]"
+    
+    try:
+        return validate_git_input(msg, 'message')
+    except SecurityError as e:
+        logging.warning(f"Mensaje generado descartado: {e}")
+        return DEFAULT_COMMIT_MESSAGE
+
+def get_sparse_cone(repo_path):
+    """
+    Retorna los directorios del cono si el repo usa sparse checkout en modo cono,
+    o None si no hay sparse checkout (o no se puede clasificar por rutas).
+    """
+    enabled = run_command_secure(['git', 'config', '--bool', '--default', 'false', 'core.sparseCheckout'],
+                                 cwd=repo_path, exit_on_error=False)
+    if enabled != 'true':
+        return None
+    
+    cone_mode = run_command_secure(['git', 'config', '--bool', '--default', 'false', 'core.sparseCheckoutCone'],
+                                   cwd=repo_path, exit_on_error=False)
+    if cone_mode != 'true':
+        # Los patrones no-cono no se pueden evaluar sin leer todo el índice
+        logging.warning("Sparse checkout sin modo cono: no se filtran rutas por cono")
+        return None
+    
+    cone_list = run_command_secure(['git', 'sparse-checkout', 'list'], cwd=repo_path, exit_on_error=False)
+    return [d.strip().strip('/') for d in (cone_list or "").splitlines() if d.strip()]
+
+def is_path_in_sparse_cone(path, cone_dirs):
+    """Indica si una ruta (relativa a la raíz) pertenece al cono sparse-checkout."""
+    is_dir = path.endswith('/')
+    path = path.strip('/')
+    
+    if is_dir:
+        # Directorio sin seguimiento ("?? dir/"): dentro si coincide o contiene parte del cono
+        return any(path == d or path.startswith(d + '/') or d.startswith(path + '/') for d in cone_dirs)
+    
+    parent = os.path.dirname(path)
+    if not parent:
+        return True  # Los archivos de la raíz siempre están en el cono
+    
+    for d in cone_dirs:
+        # Recursivo dentro del directorio del cono, o archivo directo de un ancestro suyo
+        if path.startswith(d + '/') or parent == d or d.startswith(parent + '/'):
+            return True
+    return False
+
+def stage_changes(repo_path, sparse_cone=None, status_output=None, excluded_paths=()):
+    """
+    Agrega los cambios al staging area. En sparse checkout solo se agregan las
+    rutas del cono (tomadas de status_output) para no recorrer todo el árbol, y
+    nunca se agregan las rutas excluidas por la política de confirmación.
+    """
+    if sparse_cone is None and not excluded_paths:
+        return run_command_secure(['git', 'add', '.'], cwd=repo_path, no_lazy_fetch=True)
+    
+    if getattr(status_output, 'truncated', False):
+        # Sin la lista completa de rutas un add parcial dejaría cambios fuera del commit
+        raise SecurityError("Status truncado por AUTOCOMMIT_MAX_CAPTURE_BYTES; no se puede preparar el staging por rutas")
+    
+    paths = []
+    for line in (status_output or "").splitlines():
+        if len(line) < 4:
+            continue
+        filename = line[3:].strip()
+        if filename in excluded_paths:
+            continue
+        if sparse_cone is None or is_path_in_sparse_cone(filename, sparse_cone):
+            paths.append(filename)
+    
+    if not paths:
+        return ""
+    
+    # Lista de rutas vía archivo para no exceder el límite de argumentos con miles de rutas
+    fd, pathspec_file = tempfile.mkstemp(prefix="autocommit-", suffix=".pathspec")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write('\0'.join(paths))
+        return run_command_secure(['git', '--literal-pathspecs', 'add', '-A',
+                                   f'--pathspec-from-file={pathspec_file}', '--pathspec-file-nul'],
+                                  cwd=repo_path, no_lazy_fetch=True)
+    finally:
+        os.remove(pathspec_file)
+
+# --- MOTOR DE POLÍTICAS (ejecuciones sin terminal) ---
+def sign_allowlist(entries, key):
+    """Firma HMAC-SHA256 de las entradas [{"path", "blob"}] del allowlist."""
+    payload = json.dumps(entries, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hmac.new(key.encode('utf-8'), payload, hashlib.sha256).hexdigest()
+
+def _load_allowlist(allowlist, key):
+    """Retorna {(ruta, blob)} si la firma es válida; un allowlist sin firmar se ignora."""
+    if not allowlist:
+        return set()
+    
+    entries = allowlist.get("entries", []) if isinstance(allowlist, dict) else None
+    if not isinstance(entries, list) or not all(
+            isinstance(e, dict) and isinstance(e.get("path"), str) and isinstance(e.get("blob"), str)
+            for e in entries):
+        raise SecurityError("Allowlist inválido: se esperaba {'entries': [{'path', 'blob'}], 'signature'}")
+    
+    if not key:
+        logging.warning("Allowlist ignorado: falta AUTOCOMMIT_POLICY_KEY para verificar la firma")
+        return set()
+    if not hmac.compare_digest(sign_allowlist(entries, key), str(allowlist.get("signature", ""))):
+        logging.error("Allowlist ignorado: firma inválida")
+        return set()
+    return {(e["path"], e["blob"]) for e in entries}
+
+def load_policy(path=None, key=None):
+    """
+    Carga la política declarativa (JSON). Sin archivo retorna la política por
+    defecto, que deniega todo. Un archivo inválido lanza SecurityError: nunca se
+    decide con una política a medias.
+    """
+    path = POLICY_FILE if path is None else path
+    key = POLICY_KEY if key is None else key
+    policy = {"default": "deny", "confirm_changes": "deny", "rules": [], "allowlist": set()}
+    if not path:
+        return policy
+    
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SecurityError(f"Política ilegible ({path}): {e}")
+    if not isinstance(data, dict):
+        raise SecurityError(f"Política inválida ({path}): se esperaba un objeto JSON")
+    
+    policy["default"] = _policy_action(data.get("default", "deny"), POLICY_ACTIONS, "default")
+    policy["confirm_changes"] = _policy_action(data.get("confirm_changes", "deny"), CONFIRM_ACTIONS, "confirm_changes")
+    for index, rule in enumerate(data.get("rules", [])):
+        if not isinstance(rule, dict):
+            raise SecurityError(f"Regla {index + 1} inválida: se esperaba un objeto")
+        policy["rules"].append({
+            "path": str(rule.get("path", "*")),
+            "finding": str(rule.get("finding", "")),
+            "action": _policy_action(rule.get("action"), POLICY_ACTIONS, f"regla {index + 1}")
+        })
+    policy["allowlist"] = _load_allowlist(data.get("allowlist"), key)
+    return policy
+
+def _policy_action(action, allowed, where):
+    """Valida una acción de la política."""
+    if action not in allowed:
+        raise SecurityError(f"Acción inválida en {where}: {action!r} (permitidas: {', '.join(allowed)})")
+    return action
+
+def get_active_policy():
+    """Política que decide sin preguntar (configurada o modo no interactivo); None si se pregunta."""
+    if POLICY_FILE or NONINTERACTIVE:
+        return load_policy()
+    return None
+
+def decide_finding(policy, path, reason, blob_id=None):
+    """
+    Retorna (acción, origen) para un hallazgo: allowlist firmado (ruta + blob
+    exactos), luego la primera regla que coincide (glob de ruta y texto del
+    motivo) y por último la acción por defecto.
+    """
+    if blob_id and (path, blob_id) in policy["allowlist"]:
+        return "allow", "allowlist"
+    for index, rule in enumerate(policy["rules"]):
+        if fnmatch.fnmatchcase(path, rule["path"]) and rule["finding"] in reason:
+            return rule["action"], f"regla {index + 1}"
+    return policy["default"], "default"
+
+def audit_decision(repo_path, subject, finding, action, source):
+    """Registra una decisión automática en el log de auditoría (una línea JSON)."""
+    record = {"repo": repo_path, "path": subject, "finding": finding, "action": action, "source": source}
+    logging.info(f"AUDIT {json.dumps(record, ensure_ascii=False)}")
+
+def confirm_changes(repo_path, policy):
+    """Decide si subir los cambios: por política (sin esperar) o preguntando S/n."""
+    if policy is not None:
+        action = policy["confirm_changes"]
+        if action == "prompt" and NONINTERACTIVE:
+            action = "deny"
+        if action != "prompt":
+            audit_decision(repo_path, "*", "confirmar cambios", action, "confirm_changes")
+            return action == "allow"
+    
+    try:
+        confirm = input("\n¿Subir estos cambios? (S/n): ").strip().lower()
+    except EOFError:
+        audit_decision(repo_path, "*", "confirmar cambios", "deny", "stdin cerrado")
+        return False
+    return confirm not in ('n', 'no')
+
+def read_commit_message(policy):
+    """
+    Pide el mensaje de commit y lo valida. Con política activa no se pregunta, y
+    si stdin está cerrado tampoco: retorna "" para generarlo a partir de los cambios.
+    """
+    if policy is not None:
+        return ""
+    try:
+        msg = input("✍️  Mensaje para el commit (Enter para generarlo): ").strip()
+    except EOFError:
+        logging.info("Entrada no disponible (stdin cerrado): se genera el mensaje de commit")
+        return ""
+    return validate_git_input(msg, 'message') if msg else ""
+
 # ... (Funciones de soporte is_git_repo, get_current_branch, select_project se mantienen igual) ...
 def is_git_repo(path):
     return os.path.isdir(os.path.join(path, ".git"))
@@ -309,8 +1300,61 @@ def get_current_branch(repo_path):
             raise SecurityError(f"Rama actual tiene nombre inseguro: {branch}")
     return branch
 
+def parse_push_targets(spec, branch):
+    """Convierte la especificación de destinos en una lista de (remoto, rama_destino)."""
+    targets = []
+    for entry in (spec or "origin").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+
+        remote, _, dest = entry.partition(":")
+        remote = validate_git_input(remote.strip(), 'branch')
+        dest = validate_git_input(dest.strip() or branch, 'branch')
+
+        # Evitar que un nombre se interprete como opción de git (ej: "--force")
+        if remote.startswith('-') or dest.startswith('-'):
+            raise SecurityError(f"Destino de push inseguro: {entry}")
+
+        if (remote, dest) not in targets:
+            targets.append((remote, dest))
+
+    if not targets:
+        raise SecurityError("No hay destinos de push configurados")
+    return targets
+
+def push_to_remotes(repo_path, branch, targets, max_workers=MAX_PUSH_WORKERS):
+    """
+    Sube la rama a varios remotos en paralelo, aislando los fallos de cada uno.
+    Retorna una lista de resultados (remote, branch, ok, seconds) en el orden de targets.
+    """
+    def _push(target):
+        remote, dest = target
+        refspec = branch if dest == branch else f"{branch}:refs/heads/{dest}"
+        start = time.perf_counter()
+        try:
+            output = run_command_secure(['git', 'push', remote, refspec], cwd=repo_path, exit_on_error=False)
+            ok = output is not None
+        except Exception as e:
+            logging.error(f"Error inesperado en push a {remote}: {e}")
+            ok = False
+        return {
+            "remote": remote,
+            "branch": dest,
+            "ok": ok,
+            "seconds": time.perf_counter() - start
+        }
+
+    workers = max(1, min(max_workers, len(targets)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_push, targets))
+
 def select_project():
     """Selecciona proyecto de forma segura con validación de entrada."""
+    if NONINTERACTIVE or POLICY_FILE:
+        log_and_print("Modo no interactivo: ejecuta autocommit dentro de un repositorio Git.", "error")
+        return None
+    
     if not ROOT_PROJECTS_DIR:
         log_and_print("No se encontró carpeta de proyectos raíz.", "error")
         return None
@@ -390,6 +1434,7 @@ def main():
             if not branch:
                 raise SecurityError("No se pudo determinar la rama actual")
             print(f"🌿 Rama: {branch}")
+            push_targets = parse_push_targets(PUSH_TARGETS, branch)
         except SecurityError as e:
             log_and_print(f"Error de seguridad con la rama: {e}", "error")
             sys.exit(1)
@@ -397,7 +1442,10 @@ def main():
         # 1. ACTUALIZACIÓN (Pull) - Comando seguro
         print("\n🔄 [1/4] Verificando cambios remotos...")
         try:
-            pull_result = run_command_secure(['git', 'pull', 'origin', branch], cwd=target_repo, exit_on_error=False)
+            # Siempre la rama actual: el remapeo de rama destino aplica solo al push
+            main_remote = push_targets[0][0]
+            with stage_monitor("pull"):
+                pull_result = run_command_secure(['git', 'pull', main_remote, branch], cwd=target_repo, exit_on_error=False)
             if pull_result is None:
                 log_and_print("Fallo en actualización (Pull). Revisa conflictos.", "error")
                 sys.exit(1)
@@ -408,25 +1456,34 @@ def main():
 
         # 2. SEGURIDAD (Scanner mejorado)
         print("\n🛡️ [2/4] Escaneando seguridad...")
-        if not enhanced_security_scan(target_repo):
+        policy = get_active_policy()
+        excluded_paths = set()
+        with stage_monitor("scan"):
+            scan_ok = enhanced_security_scan(target_repo, excluded_paths, policy)
+        if not scan_ok:
             logging.info("Proceso cancelado por escaneo de seguridad")
             sys.exit(1)
         print("   ✅ Escaneo de seguridad completado")
 
         # 3. VERIFICAR ESTADO
-        status = run_command_secure(['git', 'status', '--porcelain'], cwd=target_repo)
-        if not status:
+        with stage_monitor("status"):
+            status = run_command_secure(STATUS_COMMAND, cwd=target_repo, no_lazy_fetch=True)
+        if not status and not status.truncated:
             print("\n✨ [3/4] Repositorio limpio, nada que subir.")
             logging.info("Repositorio limpio, finalizando normalmente.")
             sys.exit(0)
 
         print("\n📄 [3/4] Cambios detectados:")
         print(status)
+        if status.truncated:
+            print(f"   ⚠️  Lista truncada a {MAX_CAPTURE_BYTES} bytes (AUTOCOMMIT_MAX_CAPTURE_BYTES)")
+        
+        if excluded_paths:
+            print(f"   🚧 Excluidos por la política: {', '.join(sorted(excluded_paths))}")
         
-        # Confirmación de usuario
+        # Confirmación de usuario (o de la política en ejecuciones sin terminal)
         try:
-            confirm = input("\n¿Subir estos cambios? (S/n): ").strip().lower()
-            if confirm == 'n' or confirm == 'no':
+            if not confirm_changes(target_repo, policy):
                 logging.info("Proceso cancelado por el usuario.")
                 sys.exit(0)
         except KeyboardInterrupt:
@@ -437,31 +1494,47 @@ def main():
         # 4. PREPARACIÓN Y SUBIDA
         print("\n📦 [4/4] Preparando y subiendo cambios...")
         
-        # Git add de forma segura
-        run_command_secure(['git', 'add', '.'], cwd=target_repo)
+        # Git add de forma segura (limitado al cono en sparse checkout)
+        with stage_monitor("stage"):
+            stage_changes(target_repo, get_sparse_cone(target_repo), status, excluded_paths)
         print("   ✅ Archivos agregados al staging area")
         
         # Solicitar mensaje de commit con validación
         try:
-            msg = input("✍️  Mensaje para el commit (Enter para default): ").strip()
-            if not msg:
-                msg = "Update via AutoCommit CLI"
-            
-            # Validar mensaje de commit
-            msg = validate_git_input(msg, 'message')
-            
+            msg = read_commit_message(policy)
         except SecurityError as e:
             log_and_print(f"Mensaje de commit inseguro: {e}", "error")
-            msg = "Update via AutoCommit CLI"  # Fallback seguro
-            print(f"   ⚠️  Usando mensaje seguro por defecto: {msg}")
+            msg = ""  # Fallback seguro: mensaje generado desde el diff
+            print("   ⚠️  Se usará un mensaje seguro generado a partir de los cambios")
         
-        # Commit seguro
-        run_command_secure(['git', 'commit', '-m', msg], cwd=target_repo)
+        # Commit seguro (la generación del mensaje se mide dentro de la etapa)
+        with stage_monitor("commit"):
+            if not msg:
+                with stage_monitor("commit.message"):
+                    msg = generate_commit_message(target_repo)
+                print(f"   📝 Mensaje generado: {msg}")
+            run_command_secure(['git', 'commit', '-m', msg], cwd=target_repo)
         print("   ✅ Commit creado exitosamente")
         
-        # Push seguro
-        run_command_secure(['git', 'push', 'origin', branch], cwd=target_repo)
-        print(f"   ✅ Cambios subidos a {branch}")
+        # Push seguro a todos los destinos configurados
+        with stage_monitor("push"):
+            push_results = push_to_remotes(target_repo, branch, push_targets)
+        for result in push_results:
+            target = f"{result['remote']}/{result['branch']}"
+            if result["ok"]:
+                print(f"   ✅ Cambios subidos a {target} ({result['seconds']:.2f}s)")
+                logging.info(f"Push exitoso a {target} en {result['seconds']:.2f}s")
+            else:
+                print(f"   ❌ Falló el push a {target} ({result['seconds']:.2f}s)")
+                logging.error(f"Push fallido a {target} tras {result['seconds']:.2f}s")
+
+        failed = [r for r in push_results if not r["ok"]]
+        if len(failed) == len(push_results):
+            log_and_print("Push fallido en todos los remotos. Revisa conexión y permisos.", "error")
+            sys.exit(1)
+        if failed:
+            log_and_print(f"Push parcial: {len(push_results) - len(failed)}/{len(push_results)} remotos actualizados.", "warning")
+            sys.exit(1)
         
         log_and_print("✅ Proceso completado exitosamente.")
         
@@ -476,6 +1549,10 @@ def main():
         log_and_print(f"Error inesperado: {e}", "error")
         sys.exit(1)
     finally:
+        if PROFILE_ENABLED and STAGE_STATS:
+            print("\n📊 Recursos por etapa:")
+            for stats in STAGE_STATS:
+                print(f"   {stats['stage']:<7} {_format_stage_stats(stats)}")
         logging.info("=== Finalizando sesión de AutoCommit CLI ===")
 
 if __name__ == "__main__":